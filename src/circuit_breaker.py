@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+from dataclasses import dataclass
+import hashlib
+import json
+from pathlib import Path
+import threading
+import time
+
+DEFAULT_COOLDOWN_SECONDS = 3600.0
+HALF_OPEN_PROBE_TIMEOUT_SECONDS = 120.0
+
+
+@dataclass
+class BreakerState:
+    failures: int = 0
+    opened_at: float | None = None
+    cooldown_s: float = DEFAULT_COOLDOWN_SECONDS
+    probe_started_at: float | None = None
+
+
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.strip().encode("utf-8")).hexdigest()[:16]
+
+
+class CircuitBreaker:
+    """Skips (API key, model) pairs that recently failed with a daily quota error.
+
+    Tripped entries stay open until their cooldown expires, then let a single
+    half-open probe through; a success closes the entry, another quota error
+    re-opens it. State is persisted so restarts do not re-probe dead pairs.
+    """
+
+    def __init__(self, state_file: str | Path | None = None) -> None:
+        self.state_file = Path(state_file) if state_file is not None else None
+        self._states: dict[tuple[str, str], BreakerState] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def is_open(self, api_key: str, model_name: str) -> bool:
+        now = time.time()
+        with self._lock:
+            state = self._states.get((hash_api_key(api_key), model_name))
+            if state is None or state.opened_at is None:
+                return False
+            if now - state.opened_at < state.cooldown_s:
+                return True
+            probe_pending = (
+                state.probe_started_at is not None
+                and now - state.probe_started_at < HALF_OPEN_PROBE_TIMEOUT_SECONDS
+            )
+            if probe_pending:
+                return True
+            state.probe_started_at = now
+            return False
+
+    def all_open(self, api_key: str, model_names: Iterable[str]) -> bool:
+        """Report whether every model is open for api_key, without claiming a half-open probe."""
+        key_hash = hash_api_key(api_key)
+        now = time.time()
+        with self._lock:
+            for model_name in model_names:
+                state = self._states.get((key_hash, model_name))
+                if state is None or state.opened_at is None:
+                    return False
+                if now - state.opened_at < state.cooldown_s:
+                    continue
+                probe_pending = (
+                    state.probe_started_at is not None
+                    and now - state.probe_started_at < HALF_OPEN_PROBE_TIMEOUT_SECONDS
+                )
+                if not probe_pending:
+                    return False
+            return True
+
+    def has_recent_trip(self, api_key: str, within_s: float) -> bool:
+        key_hash = hash_api_key(api_key)
+        cutoff = time.time() - within_s
+        with self._lock:
+            return any(
+                state_key_hash == key_hash and state.opened_at is not None and state.opened_at >= cutoff
+                for (state_key_hash, _model_name), state in self._states.items()
+            )
+
+    def trip(self, api_key: str, model_name: str, cooldown_s: float = DEFAULT_COOLDOWN_SECONDS) -> None:
+        with self._lock:
+            state = self._states.setdefault((hash_api_key(api_key), model_name), BreakerState())
+            state.failures += 1
+            state.opened_at = time.time()
+            state.cooldown_s = cooldown_s
+            state.probe_started_at = None
+            self._save_locked()
+
+    def close(self, api_key: str, model_name: str) -> None:
+        with self._lock:
+            if self._states.pop((hash_api_key(api_key), model_name), None) is not None:
+                self._save_locked()
+
+    def _load(self) -> None:
+        if self.state_file is None:
+            return
+        try:
+            raw_states = json.loads(self.state_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if not isinstance(raw_states, dict):
+            return
+
+        for raw_key, raw_state in raw_states.items():
+            key_hash, separator, model_name = str(raw_key).partition("|")
+            if not separator or not isinstance(raw_state, dict):
+                continue
+            try:
+                self._states[(key_hash, model_name)] = BreakerState(
+                    failures=int(raw_state.get("failures", 0)),
+                    opened_at=float(raw_state["opened_at"]),
+                    cooldown_s=float(raw_state.get("cooldown_s", DEFAULT_COOLDOWN_SECONDS)),
+                )
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    def _save_locked(self) -> None:
+        if self.state_file is None:
+            return
+        serialized = {
+            f"{key_hash}|{model_name}": {
+                "failures": state.failures,
+                "opened_at": state.opened_at,
+                "cooldown_s": state.cooldown_s,
+            }
+            for (key_hash, model_name), state in self._states.items()
+            if state.opened_at is not None
+        }
+        try:
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            self.state_file.write_text(json.dumps(serialized), encoding="utf-8")
+        except OSError:
+            pass
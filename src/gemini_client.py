@@ -1,56 +1,200 @@
 from __future__ import annotations
 
+import asyncio
+from collections.abc import Coroutine, Sequence
+import functools
+import json
+import logging
+import mimetypes
 import os
 from pathlib import Path
-from typing import Any
-
+import random
+import re
+import stat
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from google.ai import generativelanguage as glm
 import google.generativeai as genai
-from google.api_core.exceptions import GoogleAPIError, RetryError
+from google.generativeai import client as genai_client
+from google.generativeai.types import content_types
+from google.api_core.exceptions import DeadlineExceeded, GoogleAPIError, RetryError
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from circuit_breaker import CircuitBreaker
+from response_cache import ResponseCache, hash_image
+
+if TYPE_CHECKING:
+    from screenshot_snippet import Point
+
 DEFAULT_MODEL_NAME = "gemini-3.1-pro-preview"
+INLINE_DATA_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_REQUEST_TIMEOUT_SECONDS = 30.0
 TEST_MODE_API_KEY = "test"
-TEST_FREE_RESPONSE_JSON = (
-    '{"question_type":"free_response","explanation":"Test mode response with intentionally long text to simulate notification overflow behavior.",'
-    '"verification":"Test mode bypassed Gemini and returned a stress-test payload with long free-response content.",'
-    '"answer":"This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays.",'
-    '"free_response_answer":"This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays."}'
+TEST_FREE_RESPONSE_JSON = r'''{"question_type":"free_response","explanation":"Test mode response with intentionally long text to simulate notification overflow behavior.","verification":"Test mode bypassed Gemini and returned a stress-test payload with long free-response content.","answer":"This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays.","free_response_answer":"This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays. This is a predefined free response answer for testing. This sentence is repeated to create a very long message that is likely to exceed notification limits in some system trays."}'''
+TEST_FREE_RESPONSE_PARSED: dict[str, Any] = json.loads(TEST_FREE_RESPONSE_JSON)
+API_KEY_ENV_VAR_NAMES = (
+    "GEMINI_API_KEY",
+    "GEMINI_API_KEY_SECOND",
+    "GEMINI_API_KEY_THIRD",
+    "GEMINI_API_KEY_FOURTH",
 )
-MODEL_FALLBACK_PRIORITY = [
+MODEL_FALLBACK_PRIORITY = (
     "gemini-3.1-pro-preview",
     "gemini-2.5-pro",
     "gemini-2.5-flash",
     "gemini-3-flash-preview",
     "gemini-2.5-flash-lite",
-]
+)
 
+BATCH_MODE_ENV_VAR = "GEMINI_BATCH_MODE"
+BATCH_DISPLAY_NAME = "questions-done-quick"
+BATCH_POLL_SECONDS = 10.0
+# Batch jobs target a 24 hour turnaround; past that the job is treated as stuck.
+BATCH_TIMEOUT_SECONDS = 24 * 3600.0
+BATCH_COMPLETED_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
+CACHE_DIRECTORY = Path.home() / ".cache" / "qdq"
+DAILY_QUOTA_COOLDOWN_SECONDS = 3600.0
+SPECULATIVE_DISPATCH_ENV_VAR = "SPECULATIVE_DISPATCH"
+SPECULATIVE_DISPATCH_DELAY_SECONDS = 0.2
+SPECULATIVE_QUOTA_WINDOW_SECONDS = 3600.0
+TRANSIENT_RETRY_ATTEMPTS = 3
+TRANSIENT_BACKOFF_BASE_SECONDS = 0.5
+TRANSIENT_BACKOFF_CAP_SECONDS = 20.0
+
+# mimetypes only ships a .webp entry from Python 3.13, so the snippet upload types are pinned here.
+IMAGE_MIME_TYPES = {
+    ".webp": "image/webp",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+}
+
+_CODE_BLOCK_RE = re.compile(r"```(?:json)?\s*(\{.*\})\s*```", re.IGNORECASE | re.DOTALL)
+_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+_QUOTA_SIGNAL_RE = re.compile(
+    r"quota|resource_exhausted|generate_content_free_tier_requests|generaterequestsperdayperprojectpermodel-freetier|429"
+)
+_QUOTA_SCOPE_RE = re.compile(r"daily|per ?day|free_?tier")
 
-def _resolve_api_key(api_key: str | None = None) -> str | None:
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+_circuit_breaker = CircuitBreaker(state_file=CACHE_DIRECTORY / "breaker.json")
+_response_cache = ResponseCache(database_file=CACHE_DIRECTORY / "responses.db")
+_last_configured_key: str | None = None
+
+_event_loop: asyncio.AbstractEventLoop | None = None
+_event_loop_lock = threading.Lock()
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    # The SDK's async gRPC clients stay bound to the loop they were first used on,
+    # so every request runs on one long-lived loop instead of a fresh asyncio.run().
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="gemini-event-loop", daemon=True).start()
+            _event_loop = loop
+        return _event_loop
+
+
+def _run_coroutine(coroutine: Coroutine[Any, Any, T]) -> T:
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_event_loop()).result()
+
+
+async def _await_on_shared_loop(coroutine: Coroutine[Any, Any, T]) -> T:
+    # Public async entry points may be awaited from any loop (e.g. repeated asyncio.run calls), but the
+    # cached gRPC clients belong to the shared loop, so the work is always scheduled there.
+    loop = _get_event_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coroutine
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+
+@functools.lru_cache(maxsize=1)
+def _load_environment() -> None:
     load_dotenv()
+
+
+def _resolve_api_key(api_key: str | None = None) -> str | None:
+    _load_environment()
     return api_key or os.getenv("GEMINI_API_KEY")
 
 
 def _resolve_api_key_candidates(api_key: str | None = None) -> list[str]:
-    load_dotenv()
     if api_key:
         return [api_key]
+    _load_environment()
 
-    candidates: list[str] = []
-    env_var_names = (
-        "GEMINI_API_KEY",
-        "GEMINI_API_KEY_SECOND",
-        "GEMINI_API_KEY_THIRD",
-        "GEMINI_API_KEY_FOURTH",
+    # Documented keys keep their priority; any other GEMINI_API_KEY* variables follow in name order.
+    extra_env_var_names = sorted(
+        name for name in os.environ if name.startswith("GEMINI_API_KEY") and name not in API_KEY_ENV_VAR_NAMES
     )
-    for env_var_name in env_var_names:
-        raw_value = os.getenv(env_var_name)
-        if raw_value is None:
-            continue
-        cleaned_value = raw_value.strip()
-        if not cleaned_value or cleaned_value in candidates:
-            continue
-        candidates.append(cleaned_value)
-    return candidates
+    candidates: dict[str, None] = {}
+    for env_var_name in (*API_KEY_ENV_VAR_NAMES, *extra_env_var_names):
+        cleaned_value = (os.getenv(env_var_name) or "").strip()
+        if cleaned_value:
+            candidates.setdefault(cleaned_value, None)
+    return list(candidates)
+
+
+def _json_loads(text: str) -> Any:
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch one type either way.
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def extract_response_json(response_text: str) -> dict[str, Any] | None:
+    """Return the JSON object in a Gemini response, tolerating markdown fences or surrounding prose."""
+    compact = response_text.strip()
+
+    # The prompt asks for bare JSON, so try that before any regex work.
+    try:
+        candidate = _json_loads(compact)
+    except json.JSONDecodeError:
+        pass
+    else:
+        return candidate if isinstance(candidate, dict) else None
+
+    if "```" in compact:
+        code_match = _CODE_BLOCK_RE.search(compact)
+        if code_match:
+            compact = code_match.group(1).strip()
+            try:
+                candidate = _json_loads(compact)
+            except json.JSONDecodeError:
+                pass
+            else:
+                if isinstance(candidate, dict):
+                    return candidate
+
+    object_match = _OBJECT_RE.search(compact)
+    if object_match:
+        try:
+            candidate = _json_loads(object_match.group(0))
+        except json.JSONDecodeError:
+            return None
+        if isinstance(candidate, dict):
+            return candidate
+
+    return None
 
 
 def _describe_key_for_log(api_key_value: str) -> str:
@@ -63,6 +207,8 @@ def _describe_key_for_log(api_key_value: str) -> str:
 
 
 def _is_test_mode(api_key: str | None = None) -> bool:
+    if api_key:
+        return api_key.strip().lower() == TEST_MODE_API_KEY
     resolved_key = _resolve_api_key(api_key)
     if resolved_key is None:
         return False
@@ -70,106 +216,238 @@ def _is_test_mode(api_key: str | None = None) -> bool:
 
 
 def initialize_gemini(api_key: str | None = None) -> None:
+    global _last_configured_key
     resolved_key = _resolve_api_key(api_key)
     if not resolved_key:
         raise ValueError("Missing Gemini API key. Set GEMINI_API_KEY in .env or pass api_key.")
+    if resolved_key == _last_configured_key:
+        return
     genai.configure(api_key=resolved_key)
+    _last_configured_key = resolved_key
+
+
+@functools.lru_cache(maxsize=8)
+def _get_async_client(api_key: str) -> glm.GenerativeServiceAsyncClient:
+    # One explicit client per key, so generation never depends on the process-wide genai.configure()
+    # state. Created lazily from coroutines on the shared event loop, which the gRPC channel binds to.
+    return glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
 
 
-def upload_image(image_path: str | Path) -> Any:
+async def _generate_content_async(
+    api_key: str,
+    model_name: str,
+    contents: Any,
+    timeout_s: float,
+) -> str | None:
+    request = genai.protos.GenerateContentRequest(
+        model=f"models/{model_name}",
+        contents=content_types.to_contents(contents),
+    )
+    if request.contents and not request.contents[-1].role:
+        request.contents[-1].role = "user"
+    # retry=None: the generated client otherwise retries 503s for up to 600s, resetting the per-attempt
+    # timeout each time; _generate_with_model_fallback already does its own jittered retries.
+    response = await _get_async_client(api_key).generate_content(request, retry=None, timeout=timeout_s)
+    return genai.types.AsyncGenerateContentResponse.from_response(response).text
+
+
+@functools.lru_cache(maxsize=8)
+def _get_file_client(api_key: str) -> genai_client.FileServiceClient:
+    # Per-key File API client, so concurrent uploads for different keys never share genai.configure() state.
+    return genai_client.FileServiceClient(client_options={"api_key": api_key})
+
+
+async def _count_tokens_async(api_key: str, model_name: str, contents: Any) -> None:
+    request = genai.protos.CountTokensRequest(
+        model=f"models/{model_name}",
+        contents=content_types.to_contents(contents),
+    )
+    await _get_async_client(api_key).count_tokens(request, retry=None, timeout=DEFAULT_REQUEST_TIMEOUT_SECONDS)
+
+
+def _image_mime_type(image_path: str | Path) -> str:
+    suffix = os.path.splitext(os.fspath(image_path))[1].lower()
+    mime_type = IMAGE_MIME_TYPES.get(suffix) or mimetypes.guess_type(os.fspath(image_path))[0]
+    if mime_type is None:
+        raise ValueError(f"Unknown image type for upload: {image_path}")
+    return mime_type
+
+
+def upload_image(image_path: str | Path, api_key: str | None = None) -> Any:
+    try:
+        file_stat = os.stat(image_path)
+    except FileNotFoundError as exc:
+        raise FileNotFoundError(f"Image file not found: {image_path}") from exc
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise FileNotFoundError(f"Image file not found: {image_path}")
+    mime_type = _image_mime_type(image_path)
+    if api_key is None:
+        return genai.upload_file(path=os.fspath(image_path), mime_type=mime_type)
     file_path = Path(image_path)
-    if not file_path.exists() or not file_path.is_file():
-        raise FileNotFoundError(f"Image file not found: {file_path}")
-    return genai.upload_file(path=str(file_path))
+    uploaded = _get_file_client(api_key).create_file(
+        path=file_path,
+        mime_type=mime_type,
+        display_name=file_path.name,
+    )
+    return genai.types.File(uploaded)
+
+
+async def _upload_image_async(image_path: str | Path, api_key: str | None = None) -> Any:
+    return await asyncio.to_thread(upload_image, image_path, api_key)
 
 
 def _is_daily_quota_error(exc: Exception) -> bool:
     message = str(exc).lower()
-    has_quota_signal = any(
-        token in message
-        for token in (
-            "quota",
-            "quota exceeded",
-            "exceeded your current quota",
-            "generate_content_free_tier_requests",
-            "generaterequestsperdayperprojectpermodel-freetier",
-            "resource_exhausted",
-            "429",
-        )
-    )
-    has_scope_signal = any(
-        token in message
-        for token in (
-            "daily",
-            "per day",
-            "perday",
-            "free_tier",
-            "freetier",
-        )
-    )
-    return has_quota_signal and has_scope_signal
+    return bool(_QUOTA_SIGNAL_RE.search(message) and _QUOTA_SCOPE_RE.search(message))
+
 
+@functools.lru_cache(maxsize=16)
+def _model_fallback_order(primary_model: str) -> tuple[str, ...]:
+    return (primary_model, *[name for name in MODEL_FALLBACK_PRIORITY if name != primary_model])
 
-def _model_fallback_order(primary_model: str) -> list[str]:
-    ordered_models = list(MODEL_FALLBACK_PRIORITY)
-    if primary_model in ordered_models:
-        ordered_models = [primary_model, *[name for name in ordered_models if name != primary_model]]
-        return ordered_models
 
-    ordered_models.insert(0, primary_model)
-    for model_name in MODEL_FALLBACK_PRIORITY:
-        if model_name not in ordered_models:
-            ordered_models.append(model_name)
-    return ordered_models
+def _is_transient_error(exc: Exception) -> bool:
+    if isinstance(exc, RetryError):
+        return True
+    if _is_daily_quota_error(exc):
+        return False
+    status_code = getattr(exc, "code", None)
+    return isinstance(status_code, int) and (status_code == 429 or 500 <= status_code < 600)
+
 
+def _full_jitter_delay(attempt: int) -> float:
+    return random.uniform(0, min(TRANSIENT_BACKOFF_CAP_SECONDS, TRANSIENT_BACKOFF_BASE_SECONDS * 2**attempt))
 
-def _generate_with_model_fallback(prompt: str, content_part: Any, primary_model: str) -> str:
+
+async def _generate_with_model_fallback(
+    prompt: str,
+    content_part: Any,
+    primary_model: str,
+    api_key: str,
+    timeout_s: float,
+) -> str:
     last_error: Exception | None = None
     for model_name in _model_fallback_order(primary_model):
-        try:
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content([prompt, content_part])
-            text = getattr(response, "text", None)
-            if isinstance(text, str) and text.strip():
-                return text
-            raise RuntimeError("Gemini returned an empty response.")
-        except (GoogleAPIError, RetryError, OSError, ValueError) as exc:
-            last_error = exc
-            if _is_daily_quota_error(exc):
-                continue
-            raise RuntimeError(f"Gemini request failed: {exc}") from exc
+        if _circuit_breaker.is_open(api_key, model_name):
+            continue
+        for attempt in range(TRANSIENT_RETRY_ATTEMPTS):
+            try:
+                text = await _generate_content_async(api_key, model_name, [prompt, content_part], timeout_s)
+                if isinstance(text, str) and text.strip():
+                    _circuit_breaker.close(api_key, model_name)
+                    return text
+                raise RuntimeError("Gemini returned an empty response.")
+            except (GoogleAPIError, RetryError, OSError, ValueError) as exc:
+                last_error = exc
+                if isinstance(exc, DeadlineExceeded):
+                    break
+                if _is_daily_quota_error(exc):
+                    _circuit_breaker.trip(api_key, model_name, cooldown_s=DAILY_QUOTA_COOLDOWN_SECONDS)
+                    break
+                if not _is_transient_error(exc):
+                    raise RuntimeError(f"Gemini request failed: {exc}") from exc
+                if attempt < TRANSIENT_RETRY_ATTEMPTS - 1:
+                    await asyncio.sleep(_full_jitter_delay(attempt))
 
     if last_error is not None:
         raise RuntimeError(f"Gemini request failed after model fallback: {last_error}") from last_error
-    raise RuntimeError("Gemini request failed after model fallback.")
+    raise RuntimeError("Gemini request skipped: every model is cooling down after daily quota errors.")
+
 
+def _should_dispatch_speculatively(api_key_candidates: list[str]) -> bool:
+    if len(api_key_candidates) < 2:
+        return False
+    _load_environment()
+    if os.getenv(SPECULATIVE_DISPATCH_ENV_VAR, "").strip() != "1":
+        return False
+    return _circuit_breaker.has_recent_trip(api_key_candidates[0], within_s=SPECULATIVE_QUOTA_WINDOW_SECONDS)
 
-def _generate_with_api_key_fallback(
+
+async def _race_api_keys(
+    prompt: str,
+    content_part: Any,
+    model_name: str,
+    primary_key: str,
+    secondary_key: str,
+    timeout_s: float,
+) -> str:
+    async def attempt(candidate_key: str, delay_s: float) -> str:
+        if delay_s:
+            await asyncio.sleep(delay_s)
+        return await _generate_with_model_fallback(
+            prompt=prompt,
+            content_part=content_part,
+            primary_model=model_name,
+            api_key=candidate_key,
+            timeout_s=timeout_s,
+        )
+
+    tasks = [
+        asyncio.create_task(attempt(primary_key, 0.0)),
+        asyncio.create_task(attempt(secondary_key, SPECULATIVE_DISPATCH_DELAY_SECONDS)),
+    ]
+    last_error: Exception | None = None
+    try:
+        for next_finished in asyncio.as_completed(tasks):
+            try:
+                return await next_finished
+            except (GoogleAPIError, RetryError, OSError, ValueError, RuntimeError) as exc:
+                last_error = exc
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    raise RuntimeError(f"Gemini request failed after speculative dispatch: {last_error}") from last_error
+
+
+async def _generate_with_api_key_fallback(
     prompt: str,
     content_part: Any,
     model_name: str,
     api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+    api_key_candidates: list[str] | None = None,
 ) -> str:
-    api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
+    if api_key_candidates is None:
+        api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
     if not api_key_candidates:
         raise ValueError("Missing Gemini API key. Set GEMINI_API_KEY in .env or pass api_key.")
 
+    first_index = 0
+    if _should_dispatch_speculatively(api_key_candidates):
+        try:
+            return await _race_api_keys(
+                prompt=prompt,
+                content_part=content_part,
+                model_name=model_name,
+                primary_key=api_key_candidates[0],
+                secondary_key=api_key_candidates[1],
+                timeout_s=timeout_s,
+            )
+        except RuntimeError as exc:
+            if len(api_key_candidates) <= 2:
+                raise
+            logger.warning("Keys #1 and #2 failed; retrying with next key. Error: %s", exc)
+            first_index = 2
+
     last_error: Exception | None = None
-    for index, candidate_key in enumerate(api_key_candidates):
-        key_label = f"key #{index + 1}"
-        print(f"[Gemini] Using {key_label}: {_describe_key_for_log(candidate_key)}")
+    for index, candidate_key in enumerate(api_key_candidates[first_index:], start=first_index):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Using key #%d: %s", index + 1, _describe_key_for_log(candidate_key))
         try:
-            initialize_gemini(api_key=candidate_key)
-            return _generate_with_model_fallback(
+            return await _generate_with_model_fallback(
                 prompt=prompt,
                 content_part=content_part,
                 primary_model=model_name,
+                api_key=candidate_key,
+                timeout_s=timeout_s,
             )
         except (GoogleAPIError, RetryError, OSError, ValueError, RuntimeError) as exc:
             last_error = exc
             has_another_key = index < len(api_key_candidates) - 1
             if has_another_key:
-                print(f"[Gemini] {key_label} failed; retrying with next key. Error: {exc}")
+                logger.warning("Key #%d failed; retrying with next key. Error: %s", index + 1, exc)
                 continue
             raise RuntimeError(f"Gemini request failed: {exc}") from exc
 
@@ -178,33 +456,51 @@ def _generate_with_api_key_fallback(
     raise RuntimeError("Gemini request failed after API key fallback.")
 
 
-def _generate_from_image_with_api_key_fallback(
+async def _generate_from_image_with_api_key_fallback(
     prompt: str,
     image_path: str | Path,
     model_name: str,
     api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+    api_key_candidates: list[str] | None = None,
 ) -> str:
-    api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
+    if api_key_candidates is None:
+        api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
     if not api_key_candidates:
         raise ValueError("Missing Gemini API key. Set GEMINI_API_KEY in .env or pass api_key.")
 
     last_error: Exception | None = None
     for index, candidate_key in enumerate(api_key_candidates):
-        key_label = f"key #{index + 1}"
-        print(f"[Gemini] Using {key_label}: {_describe_key_for_log(candidate_key)}")
+        if _circuit_breaker.all_open(candidate_key, _model_fallback_order(model_name)):
+            # Every model is cooling down for this key, so skip the upload round-trip entirely.
+            last_error = RuntimeError(
+                f"Key #{index + 1} skipped: every model is cooling down after daily quota errors."
+            )
+            logger.warning("%s", last_error)
+            continue
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Using key #%d: %s", index + 1, _describe_key_for_log(candidate_key))
         try:
-            initialize_gemini(api_key=candidate_key)
-            uploaded_image = upload_image(image_path)
-            return _generate_with_model_fallback(
+            try:
+                uploaded_image = await asyncio.wait_for(
+                    _upload_image_async(image_path, api_key=candidate_key),
+                    timeout=timeout_s,
+                )
+            except asyncio.TimeoutError as exc:
+                # The worker thread cannot be interrupted, but it no longer holds anything the next key needs.
+                raise TimeoutError(f"Uploading {image_path} timed out after {timeout_s:g}s.") from exc
+            return await _generate_with_model_fallback(
                 prompt=prompt,
                 content_part=uploaded_image,
                 primary_model=model_name,
+                api_key=candidate_key,
+                timeout_s=timeout_s,
             )
         except (GoogleAPIError, RetryError, OSError, ValueError, RuntimeError) as exc:
             last_error = exc
             has_another_key = index < len(api_key_candidates) - 1
             if has_another_key:
-                print(f"[Gemini] {key_label} failed; retrying with next key. Error: {exc}")
+                logger.warning("Key #%d failed; retrying with next key. Error: %s", index + 1, exc)
                 continue
             raise RuntimeError(f"Gemini request failed: {exc}") from exc
 
@@ -213,47 +509,476 @@ def _generate_from_image_with_api_key_fallback(
     raise RuntimeError("Gemini request failed after API key fallback.")
 
 
-def prompt_with_uploaded_image(
+async def _warm_up_gemini_async(model_name: str, api_key: str | None) -> None:
+    api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
+    if not api_key_candidates or _is_test_mode(api_key=api_key_candidates[0]):
+        return
+    try:
+        # count_tokens is free and opens the async gRPC channel the cached per-key client reuses.
+        await _count_tokens_async(api_key_candidates[0], model_name, "ping")
+    except (GoogleAPIError, RetryError, OSError, ValueError) as exc:
+        logger.debug("Gemini warm-up failed: %s", exc)
+
+
+def warm_up_gemini(model_name: str = DEFAULT_MODEL_NAME, api_key: str | None = None) -> None:
+    """Open the Gemini connection in the background so the first request skips the handshake."""
+    asyncio.run_coroutine_threadsafe(_warm_up_gemini_async(model_name, api_key), _get_event_loop())
+
+
+async def _prompt_with_uploaded_image_async(
     prompt: str,
     image_path: str | Path,
     model_name: str = DEFAULT_MODEL_NAME,
     api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+    api_key_candidates: list[str] | None = None,
 ) -> str:
-    if not prompt.strip():
+    if not prompt or not prompt.strip():
         raise ValueError("Prompt cannot be empty.")
 
-    if _is_test_mode(api_key=api_key):
+    if api_key_candidates is None:
+        api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
+    if api_key_candidates and _is_test_mode(api_key=api_key_candidates[0]):
         return TEST_FREE_RESPONSE_JSON
 
     try:
-        return _generate_from_image_with_api_key_fallback(
+        return await _generate_from_image_with_api_key_fallback(
             prompt=prompt,
             image_path=image_path,
             model_name=model_name,
             api_key=api_key,
+            timeout_s=timeout_s,
+            api_key_candidates=api_key_candidates,
         )
     except (GoogleAPIError, RetryError, OSError, ValueError, RuntimeError) as exc:
         raise RuntimeError(f"Gemini request failed: {exc}") from exc
 
 
-def prompt_with_uploaded_file(
+async def prompt_with_uploaded_image_async(
+    prompt: str,
+    image_path: str | Path,
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+) -> str:
+    return await _await_on_shared_loop(
+        _prompt_with_uploaded_image_async(
+            prompt=prompt,
+            image_path=image_path,
+            model_name=model_name,
+            api_key=api_key,
+            timeout_s=timeout_s,
+        )
+    )
+
+
+def prompt_with_uploaded_image(
+    prompt: str,
+    image_path: str | Path,
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+) -> str:
+    if not prompt or not prompt.strip():
+        raise ValueError("Prompt cannot be empty.")
+    if api_key and _is_test_mode(api_key=api_key):
+        return TEST_FREE_RESPONSE_JSON
+
+    return _run_coroutine(
+        _prompt_with_uploaded_image_async(
+            prompt=prompt,
+            image_path=image_path,
+            model_name=model_name,
+            api_key=api_key,
+            timeout_s=timeout_s,
+        )
+    )
+
+
+async def _prompt_with_screenshot_inline_async(
+    prompt: str,
+    top_left: Point,
+    bottom_right: Point,
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+) -> str:
+    if not prompt or not prompt.strip():
+        raise ValueError("Prompt cannot be empty.")
+
+    api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
+    if api_key_candidates and _is_test_mode(api_key=api_key_candidates[0]):
+        return TEST_FREE_RESPONSE_JSON
+
+    # Imported here so upload-only callers do not pull in mss/Pillow or change the process DPI awareness.
+    from screenshot_snippet import capture_screenshot, encode_screenshot_webp
+
+    screenshot = await asyncio.to_thread(capture_screenshot, top_left, bottom_right)
+    image_bytes = await asyncio.to_thread(encode_screenshot_webp, screenshot)
+    image_hash = hash_image(image_bytes)
+    cached_response = await asyncio.to_thread(_response_cache.get, image_hash, prompt, model_name)
+    if cached_response is not None:
+        return cached_response
+
+    try:
+        if len(image_bytes) + len(prompt.encode("utf-8")) < INLINE_DATA_MAX_BYTES:
+            response_text = await _generate_with_api_key_fallback(
+                prompt=prompt,
+                content_part={"mime_type": "image/webp", "data": image_bytes},
+                model_name=model_name,
+                api_key=api_key,
+                timeout_s=timeout_s,
+                api_key_candidates=api_key_candidates,
+            )
+        else:
+            # Too large for an inline request; fall back to the File API.
+            with tempfile.TemporaryDirectory() as temp_directory:
+                image_path = Path(temp_directory) / "screenshot.webp"
+                image_path.write_bytes(image_bytes)
+                response_text = await _generate_from_image_with_api_key_fallback(
+                    prompt=prompt,
+                    image_path=image_path,
+                    model_name=model_name,
+                    api_key=api_key,
+                    timeout_s=timeout_s,
+                    api_key_candidates=api_key_candidates,
+                )
+    except (GoogleAPIError, RetryError, OSError, ValueError, RuntimeError) as exc:
+        raise RuntimeError(f"Gemini request failed: {exc}") from exc
+
+    await asyncio.to_thread(_response_cache.put, image_hash, prompt, model_name, response_text)
+    return response_text
+
+
+async def prompt_with_screenshot_inline_async(
+    prompt: str,
+    top_left: Point,
+    bottom_right: Point,
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+) -> str:
+    return await _await_on_shared_loop(
+        _prompt_with_screenshot_inline_async(
+            prompt=prompt,
+            top_left=top_left,
+            bottom_right=bottom_right,
+            model_name=model_name,
+            api_key=api_key,
+            timeout_s=timeout_s,
+        )
+    )
+
+
+def prompt_with_screenshot_inline(
+    prompt: str,
+    top_left: Point,
+    bottom_right: Point,
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+) -> str:
+    if not prompt or not prompt.strip():
+        raise ValueError("Prompt cannot be empty.")
+    if api_key and _is_test_mode(api_key=api_key):
+        return TEST_FREE_RESPONSE_JSON
+
+    return _run_coroutine(
+        _prompt_with_screenshot_inline_async(
+            prompt=prompt,
+            top_left=top_left,
+            bottom_right=bottom_right,
+            model_name=model_name,
+            api_key=api_key,
+            timeout_s=timeout_s,
+        )
+    )
+
+
+def clear_response_cache() -> None:
+    _response_cache.cache_clear()
+
+
+def _batch_mode_enabled() -> bool:
+    _load_environment()
+    return os.getenv(BATCH_MODE_ENV_VAR, "").strip() == "1"
+
+
+def _create_batch_client(api_key: str | None = None) -> Any:
+    try:
+        from google import genai as genai_batch
+    except ImportError as exc:
+        raise RuntimeError("Gemini batch mode requires the google-genai package (pip install -e .[batch]).") from exc
+
+    api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
+    if not api_key_candidates:
+        raise ValueError("Missing Gemini API key. Set GEMINI_API_KEY in .env or pass api_key.")
+    return genai_batch.Client(api_key=api_key_candidates[0])
+
+
+def _batch_file_part(batch_client: Any, file: Any) -> dict[str, str]:
+    if isinstance(file, (str, Path)):
+        file_path = Path(file)
+        if not file_path.exists() or not file_path.is_file():
+            raise FileNotFoundError(f"Image file not found: {file_path}")
+        file = batch_client.files.upload(file=str(file_path), config={"mime_type": _image_mime_type(file_path)})
+    return {"file_uri": file.uri, "mime_type": file.mime_type}
+
+
+def _batch_state_name(batch_job: Any) -> str:
+    state = batch_job.state
+    return str(getattr(state, "name", state))
+
+
+def submit_batch(
+    prompts_and_files: Sequence[tuple[str, Any]],
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    batch_client: Any | None = None,
+) -> Any:
+    if not prompts_and_files:
+        raise ValueError("Batch must contain at least one prompt.")
+    if any(not prompt.strip() for prompt, _file in prompts_and_files):
+        raise ValueError("Prompt cannot be empty.")
+
+    if batch_client is None:
+        batch_client = _create_batch_client(api_key=api_key)
+    inline_requests = [
+        {
+            "contents": [
+                {
+                    "role": "user",
+                    "parts": [
+                        {"text": prompt},
+                        {"file_data": _batch_file_part(batch_client, file)},
+                    ],
+                }
+            ]
+        }
+        for prompt, file in prompts_and_files
+    ]
+    return batch_client.batches.create(
+        model=model_name,
+        src=inline_requests,
+        config={"display_name": BATCH_DISPLAY_NAME},
+    )
+
+
+def await_batch(
+    batch_job: Any,
+    api_key: str | None = None,
+    poll_seconds: float = BATCH_POLL_SECONDS,
+    timeout_s: float = BATCH_TIMEOUT_SECONDS,
+    batch_client: Any | None = None,
+) -> list[str]:
+    """Poll batch_job until it finishes and return its responses in request order.
+
+    Pass the client used for submit_batch to reuse it. Raises TimeoutError if the job has not
+    finished within timeout_s; the job itself keeps running and can be awaited again by name.
+    """
+    if batch_client is None:
+        batch_client = _create_batch_client(api_key=api_key)
+    deadline = time.monotonic() + timeout_s
+    while _batch_state_name(batch_job) not in BATCH_COMPLETED_STATES:
+        remaining_s = deadline - time.monotonic()
+        if remaining_s <= 0:
+            raise TimeoutError(
+                f"Gemini batch job {batch_job.name} did not finish within {timeout_s:g}s "
+                f"(last state {_batch_state_name(batch_job)})."
+            )
+        time.sleep(min(poll_seconds, remaining_s))
+        batch_job = batch_client.batches.get(name=batch_job.name)
+
+    state_name = _batch_state_name(batch_job)
+    if state_name != "JOB_STATE_SUCCEEDED":
+        raise RuntimeError(f"Gemini batch job {batch_job.name} finished with {state_name}: {batch_job.error}")
+
+    responses: list[str] = []
+    for index, inlined_response in enumerate(batch_job.dest.inlined_responses):
+        if inlined_response.error:
+            raise RuntimeError(f"Gemini batch request #{index + 1} failed: {inlined_response.error}")
+        text = getattr(inlined_response.response, "text", None)
+        if not isinstance(text, str) or not text.strip():
+            raise RuntimeError(f"Gemini batch request #{index + 1} returned an empty response.")
+        responses.append(text)
+    return responses
+
+
+def prompt_with_uploaded_image_parsed(
+    prompt: str,
+    image_path: str | Path,
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+) -> tuple[str, dict[str, Any] | None]:
+    """Like prompt_with_uploaded_image, but also return the response's JSON object (or None).
+
+    Test mode returns the pre-parsed payload, so callers never re-parse the fixed test response.
+    """
+    if not prompt or not prompt.strip():
+        raise ValueError("Prompt cannot be empty.")
+
+    api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
+    if api_key_candidates and _is_test_mode(api_key=api_key_candidates[0]):
+        return TEST_FREE_RESPONSE_JSON, dict(TEST_FREE_RESPONSE_PARSED)
+
+    response_text = _run_coroutine(
+        _prompt_with_uploaded_image_async(
+            prompt=prompt,
+            image_path=image_path,
+            model_name=model_name,
+            api_key=api_key,
+            timeout_s=timeout_s,
+            api_key_candidates=api_key_candidates,
+        )
+    )
+    return response_text, extract_response_json(response_text)
+
+
+async def _prompt_with_uploaded_images_batch_async(
+    prompts_and_paths: Sequence[tuple[str, str | Path]],
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+) -> list[str]:
+    tasks = [
+        asyncio.create_task(
+            _prompt_with_uploaded_image_async(
+                prompt=prompt,
+                image_path=image_path,
+                model_name=model_name,
+                api_key=api_key,
+                timeout_s=timeout_s,
+            )
+        )
+        for prompt, image_path in prompts_and_paths
+    ]
+    if not tasks:
+        return []
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+
+async def prompt_with_uploaded_images_batch_async(
+    prompts_and_paths: Sequence[tuple[str, str | Path]],
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+) -> list[str]:
+    """Run every request concurrently and return the responses in input order.
+
+    The first failure cancels the requests still in flight (so they stop spending quota)
+    and is re-raised; no partial results are returned.
+    """
+    return await _await_on_shared_loop(
+        _prompt_with_uploaded_images_batch_async(
+            prompts_and_paths=prompts_and_paths,
+            model_name=model_name,
+            api_key=api_key,
+            timeout_s=timeout_s,
+        )
+    )
+
+
+def prompt_with_uploaded_images_batch(
+    prompts_and_paths: Sequence[tuple[str, str | Path]],
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+    use_batch_api: bool | None = None,
+) -> list[str]:
+    if use_batch_api is None:
+        use_batch_api = _batch_mode_enabled()
+    if use_batch_api and len(prompts_and_paths) > 1:
+        api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
+        if not api_key_candidates or not _is_test_mode(api_key=api_key_candidates[0]):
+            batch_client = _create_batch_client(api_key=api_key_candidates[0] if api_key_candidates else None)
+            batch_job = submit_batch(prompts_and_paths, model_name=model_name, batch_client=batch_client)
+            return await_batch(batch_job, batch_client=batch_client)
+
+    return _run_coroutine(
+        _prompt_with_uploaded_images_batch_async(
+            prompts_and_paths=prompts_and_paths,
+            model_name=model_name,
+            api_key=api_key,
+            timeout_s=timeout_s,
+        )
+    )
+
+
+async def _prompt_with_uploaded_file_async(
     prompt: str,
     uploaded_file: Any,
     model_name: str = DEFAULT_MODEL_NAME,
     api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
 ) -> str:
-    if not prompt.strip():
+    if not prompt or not prompt.strip():
         raise ValueError("Prompt cannot be empty.")
 
-    if _is_test_mode(api_key=api_key):
+    api_key_candidates = _resolve_api_key_candidates(api_key=api_key)
+    if api_key_candidates and _is_test_mode(api_key=api_key_candidates[0]):
         return TEST_FREE_RESPONSE_JSON
 
     try:
-        return _generate_with_api_key_fallback(
+        return await _generate_with_api_key_fallback(
             prompt=prompt,
             content_part=uploaded_file,
             model_name=model_name,
             api_key=api_key,
+            timeout_s=timeout_s,
+            api_key_candidates=api_key_candidates,
         )
     except (GoogleAPIError, RetryError, OSError, ValueError, RuntimeError) as exc:
         raise RuntimeError(f"Gemini request failed: {exc}") from exc
+
+
+async def prompt_with_uploaded_file_async(
+    prompt: str,
+    uploaded_file: Any,
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+) -> str:
+    return await _await_on_shared_loop(
+        _prompt_with_uploaded_file_async(
+            prompt=prompt,
+            uploaded_file=uploaded_file,
+            model_name=model_name,
+            api_key=api_key,
+            timeout_s=timeout_s,
+        )
+    )
+
+
+def prompt_with_uploaded_file(
+    prompt: str,
+    uploaded_file: Any,
+    model_name: str = DEFAULT_MODEL_NAME,
+    api_key: str | None = None,
+    timeout_s: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+) -> str:
+    if not prompt or not prompt.strip():
+        raise ValueError("Prompt cannot be empty.")
+    if api_key and _is_test_mode(api_key=api_key):
+        return TEST_FREE_RESPONSE_JSON
+
+    return _run_coroutine(
+        _prompt_with_uploaded_file_async(
+            prompt=prompt,
+            uploaded_file=uploaded_file,
+            model_name=model_name,
+            api_key=api_key,
+            timeout_s=timeout_s,
+        )
+    )
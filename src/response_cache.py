@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import hashlib
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 128
+DEFAULT_MAX_DISK_ENTRIES = 1024
+
+CacheKey = tuple[bytes, str, str]
+
+
+def hash_image(image_bytes: bytes) -> bytes:
+    return hashlib.blake2b(image_bytes, digest_size=16).digest()
+
+
+class ResponseCache:
+    """Thread-safe LRU of (image hash, prompt, model) -> response text.
+
+    Recent entries live in memory; every entry is also written through to a
+    small SQLite file so repeated captures survive restarts.
+    """
+
+    def __init__(
+        self,
+        database_file: str | Path | None = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_disk_entries: int = DEFAULT_MAX_DISK_ENTRIES,
+    ) -> None:
+        self.database_file = Path(database_file) if database_file is not None else None
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._entries: OrderedDict[CacheKey, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._database_ready = False
+
+    def get(self, image_hash: bytes, prompt: str, model_name: str) -> str | None:
+        key = (image_hash, prompt, model_name)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                return cached
+
+        cached = self._read_from_disk(key)
+        if cached is not None:
+            self._remember(key, cached)
+        return cached
+
+    def put(self, image_hash: bytes, prompt: str, model_name: str, response_text: str) -> None:
+        key = (image_hash, prompt, model_name)
+        self._remember(key, response_text)
+        self._write_to_disk(key, response_text)
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            connection = self._connect()
+            if connection is None:
+                return
+            try:
+                with connection:
+                    connection.execute("DELETE FROM responses")
+            except sqlite3.Error:
+                pass
+            finally:
+                connection.close()
+
+    def _remember(self, key: CacheKey, response_text: str) -> None:
+        with self._lock:
+            self._entries[key] = response_text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _connect(self) -> sqlite3.Connection | None:
+        if self.database_file is None:
+            return None
+        try:
+            if not self._database_ready:
+                self.database_file.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.database_file, timeout=1.0)
+            if not self._database_ready:
+                with connection:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS responses ("
+                        "image_hash BLOB NOT NULL, prompt TEXT NOT NULL, model_name TEXT NOT NULL, "
+                        "response_text TEXT NOT NULL, created_at REAL NOT NULL, "
+                        "PRIMARY KEY (image_hash, prompt, model_name))"
+                    )
+                self._database_ready = True
+            return connection
+        except (OSError, sqlite3.Error):
+            return None
+
+    def _read_from_disk(self, key: CacheKey) -> str | None:
+        with self._lock:
+            connection = self._connect()
+        if connection is None:
+            return None
+        try:
+            row = connection.execute(
+                "SELECT response_text FROM responses WHERE image_hash = ? AND prompt = ? AND model_name = ?",
+                key,
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        finally:
+            connection.close()
+        return row[0] if row is not None else None
+
+    def _write_to_disk(self, key: CacheKey, response_text: str) -> None:
+        with self._lock:
+            connection = self._connect()
+        if connection is None:
+            return
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (*key, response_text, time.time()),
+                )
+                connection.execute(
+                    "DELETE FROM responses WHERE rowid NOT IN "
+                    "(SELECT rowid FROM responses ORDER BY created_at DESC LIMIT ?)",
+                    (self.max_disk_entries,),
+                )
+        except sqlite3.Error:
+            pass
+        finally:
+            connection.close()
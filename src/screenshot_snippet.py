@@ -1,13 +1,20 @@
 from __future__ import annotations
 
+import atexit
 import ctypes
+import functools
+import io
 from pathlib import Path
+import threading
 from typing import Tuple
 
 import mss
+import mss.base
 import mss.tools
+from PIL import Image
 
 Point = Tuple[int, int]
+WEBP_QUALITY = 85
 
 
 def _enable_windows_dpi_awareness() -> None:
@@ -25,6 +32,35 @@ def _enable_windows_dpi_awareness() -> None:
 
 _enable_windows_dpi_awareness()
 
+_tls = threading.local()
+_open_grabbers: list[mss.base.MSSBase] = []
+_open_grabbers_lock = threading.Lock()
+
+
+def _get_sct() -> mss.base.MSSBase:
+    """Return this thread's MSS instance, creating it on first use.
+
+    MSS handles hold per-thread GDI resources on Windows, so each thread keeps its own.
+    """
+    sct = getattr(_tls, "sct", None)
+    if sct is None:
+        sct = _tls.sct = mss.mss()
+        with _open_grabbers_lock:
+            _open_grabbers.append(sct)
+    return sct
+
+
+@atexit.register
+def _close_grabbers() -> None:
+    with _open_grabbers_lock:
+        grabbers = list(_open_grabbers)
+        _open_grabbers.clear()
+    for sct in grabbers:
+        try:
+            sct.close()
+        except Exception:  # pragma: no cover
+            pass
+
 
 def _build_monitor_region(top_left: Point, bottom_right: Point) -> dict[str, int]:
     """Build an MSS monitor dictionary from two corner points.
@@ -51,14 +87,47 @@ def _build_monitor_region(top_left: Point, bottom_right: Point) -> dict[str, int
     }
 
 
-def _clamp_region_to_virtual_desktop(region: dict[str, int]) -> dict[str, int]:
+@functools.lru_cache(maxsize=1)
+def _virtual_bounds() -> tuple[int, int, int, int]:
+    """Return (left, top, right, bottom) of the virtual desktop spanning all monitors."""
     with mss.mss() as sct:
         virtual_monitor = sct.monitors[0]
 
     virtual_left = int(virtual_monitor["left"])
     virtual_top = int(virtual_monitor["top"])
-    virtual_right = virtual_left + int(virtual_monitor["width"])
-    virtual_bottom = virtual_top + int(virtual_monitor["height"])
+    return (
+        virtual_left,
+        virtual_top,
+        virtual_left + int(virtual_monitor["width"]),
+        virtual_top + int(virtual_monitor["height"]),
+    )
+
+
+def refresh_virtual_bounds() -> None:
+    """Forget the cached virtual desktop bounds, e.g. after monitors are added or rearranged."""
+    _virtual_bounds.cache_clear()
+
+
+def _region_within(region: dict[str, int], bounds: tuple[int, int, int, int]) -> bool:
+    virtual_left, virtual_top, virtual_right, virtual_bottom = bounds
+    return (
+        region["left"] >= virtual_left
+        and region["top"] >= virtual_top
+        and region["left"] + region["width"] <= virtual_right
+        and region["top"] + region["height"] <= virtual_bottom
+    )
+
+
+def _clamp_region_to_virtual_desktop(region: dict[str, int]) -> dict[str, int]:
+    if _region_within(region, _virtual_bounds()):
+        return region
+
+    # The cached bounds may predate a monitor being added, moved or resized; re-read them once before clamping.
+    refresh_virtual_bounds()
+    bounds = _virtual_bounds()
+    if _region_within(region, bounds):
+        return region
+    virtual_left, virtual_top, virtual_right, virtual_bottom = bounds
 
     requested_left = int(region["left"])
     requested_top = int(region["top"])
@@ -91,11 +160,19 @@ def capture_screenshot(top_left: Point, bottom_right: Point) -> mss.screenshot.S
     Returns:
         An MSS ScreenShot object containing raw BGRA pixel data.
     """
+    sct = _get_sct()
     monitor_region = _build_monitor_region(top_left, bottom_right)
     monitor_region = _clamp_region_to_virtual_desktop(monitor_region)
+    return sct.grab(monitor_region)
 
-    with mss.mss() as sct:
-        return sct.grab(monitor_region)
+
+def _to_pil_image(image: mss.screenshot.ScreenShot) -> Image.Image:
+    # Pillow's BGRX decoder drops alpha and swaps channels in C, straight from the raw buffer.
+    return Image.frombuffer("RGB", image.size, image.raw, "raw", "BGRX", 0, 1)
+
+
+def _bgra_to_rgb(image: mss.screenshot.ScreenShot) -> bytes:
+    return _to_pil_image(image).tobytes()
 
 
 def save_screenshot(image: mss.screenshot.ScreenShot, output_path: str | Path) -> Path:
@@ -103,17 +180,46 @@ def save_screenshot(image: mss.screenshot.ScreenShot, output_path: str | Path) -
     destination = Path(output_path)
     destination.parent.mkdir(parents=True, exist_ok=True)
 
-    mss.tools.to_png(image.rgb, image.size, output=str(destination))
+    mss.tools.to_png(_bgra_to_rgb(image), image.size, output=str(destination))
+    return destination
+
+
+def save_screenshot_webp(
+    image: mss.screenshot.ScreenShot,
+    output_path: str | Path,
+    quality: int = WEBP_QUALITY,
+) -> Path:
+    """Save an MSS screenshot image to disk as lossy WebP.
+
+    WebP encodes faster than PNG and is several times smaller, which keeps
+    Gemini uploads short.
+    """
+    destination = Path(output_path)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+
+    _to_pil_image(image).save(destination, "WEBP", quality=quality, method=4)
     return destination
 
 
+def encode_screenshot_webp(image: mss.screenshot.ScreenShot, quality: int = WEBP_QUALITY) -> bytes:
+    """Encode an MSS screenshot image to WebP bytes in memory."""
+    buffer = io.BytesIO()
+    _to_pil_image(image).save(buffer, "WEBP", quality=quality, method=4)
+    return buffer.getvalue()
+
+
 def capture_and_save(
     top_left: Point,
     bottom_right: Point,
     output_path: str | Path,
 ) -> Path:
-    """Capture a rectangular screenshot and save it to disk as PNG."""
+    """Capture a rectangular screenshot and save it to disk.
+
+    The format follows the output suffix: ``.webp`` for uploads, PNG otherwise.
+    """
     screenshot = capture_screenshot(top_left, bottom_right)
+    if Path(output_path).suffix.lower() == ".webp":
+        return save_screenshot_webp(screenshot, output_path)
     return save_screenshot(screenshot, output_path)
 
 
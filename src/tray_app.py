@@ -1,21 +1,24 @@
 from __future__ import annotations
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import ctypes
 from ctypes import wintypes
-from datetime import datetime
-import json
+import logging
+import os
 from pathlib import Path
+import queue
 import re
 import string
 import threading
 import time
 import traceback
-from typing import Any, List
+from typing import Any, List, NamedTuple
 
 from PIL import Image, ImageDraw
 import pystray
 
-from gemini_client import prompt_with_uploaded_image
+from gemini_client import prompt_with_uploaded_image_parsed, warm_up_gemini
 from screenshot_snippet import capture_and_save
 from tray_icon_library import PredefinedTrayIcons
 
@@ -27,6 +30,11 @@ HOTKEY_ID_TOP_LEFT = 1
 HOTKEY_ID_BOTTOM_RIGHT = 2
 VK_LEFT = 0x25
 VK_RIGHT = 0x27
+INFINITE = 0xFFFFFFFF
+QS_ALLINPUT = 0x04FF
+MWMO_INPUTAVAILABLE = 0x0004
+WAIT_OBJECT_0 = 0
+PM_REMOVE = 0x0001
 GEMINI_MODEL_NAME = "gemini-3.1-pro-preview"
 GEMINI_IMAGE_PROMPT = (
     "You are solving a multiple-choice quiz from the screenshot. "
@@ -41,14 +49,121 @@ GEMINI_IMAGE_PROMPT = (
     "For free_response, put the final written response in free_response_answer."
 )
 GEMINI_NOTIFICATION_MAX_LENGTH = 240
-IMAGE_READY_TIMEOUT_SECONDS = 2.0
-IMAGE_READY_POLL_SECONDS = 0.05
+ICON_IMAGE_CACHE_SIZE = 64
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_ANSWER_KEYWORDS = ("ANSWER", "OPTION", "CHOICE")
+_ANSWER_LETTER_RE = re.compile(r"\b([A-Z])\b")
+
+logger = logging.getLogger(__name__)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _letter_after_keyword(text: str, start: int, end: int) -> str | None:
+    # Mirrors r"\bKEYWORD\b\s*[:\-]?\s*\(?\s*([A-Z])" without running a regex.
+    length = len(text)
+    if (start > 0 and _is_word_char(text[start - 1])) or (end < length and _is_word_char(text[end])):
+        return None
+    index = end
+    while index < length and text[index].isspace():
+        index += 1
+    if index < length and text[index] in ":-":
+        index += 1
+    while index < length and text[index].isspace():
+        index += 1
+    if index < length and text[index] == "(":
+        index += 1
+    while index < length and text[index].isspace():
+        index += 1
+    if index < length and "A" <= text[index] <= "Z":
+        return text[index]
+    return None
+
+
+def _find_answer_phrase_letter(text: str) -> str | None:
+    # Earliest "ANSWER"/"OPTION"/"CHOICE" phrase followed by a letter wins, as with a regex search.
+    best_start = len(text)
+    best_letter = None
+    for keyword in _ANSWER_KEYWORDS:
+        start = text.find(keyword)
+        while start != -1 and start < best_start:
+            letter = _letter_after_keyword(text, start, start + len(keyword))
+            if letter is not None:
+                best_start, best_letter = start, letter
+                break
+            start = text.find(keyword, start + 1)
+    return best_letter
 
 
 class POINT(ctypes.Structure):
     _fields_ = [("x", ctypes.c_long), ("y", ctypes.c_long)]
 
 
+try:
+    _user32 = ctypes.WinDLL("user32", use_last_error=True)
+    _kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+except (AttributeError, OSError):  # pragma: no cover
+    _user32 = None
+    _kernel32 = None
+
+
+def _bind_win32(library: Any, name: str, argtypes: list[Any], restype: Any) -> Any:
+    # Resolve the symbol and its marshalling once instead of on every call through ctypes.windll.
+    if library is None:
+        return None
+    function = getattr(library, name)
+    function.argtypes = argtypes
+    function.restype = restype
+    return function
+
+
+_GetCursorPos = _bind_win32(_user32, "GetCursorPos", [ctypes.POINTER(POINT)], wintypes.BOOL)
+_PeekMessageW = _bind_win32(
+    _user32,
+    "PeekMessageW",
+    [ctypes.POINTER(wintypes.MSG), wintypes.HWND, wintypes.UINT, wintypes.UINT, wintypes.UINT],
+    wintypes.BOOL,
+)
+_MsgWaitForMultipleObjectsEx = _bind_win32(
+    _user32,
+    "MsgWaitForMultipleObjectsEx",
+    [wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE), wintypes.DWORD, wintypes.DWORD, wintypes.DWORD],
+    wintypes.DWORD,
+)
+_RegisterHotKey = _bind_win32(
+    _user32,
+    "RegisterHotKey",
+    [wintypes.HWND, ctypes.c_int, wintypes.UINT, wintypes.UINT],
+    wintypes.BOOL,
+)
+_UnregisterHotKey = _bind_win32(_user32, "UnregisterHotKey", [wintypes.HWND, ctypes.c_int], wintypes.BOOL)
+_CreateEventW = _bind_win32(
+    _kernel32,
+    "CreateEventW",
+    [wintypes.LPVOID, wintypes.BOOL, wintypes.BOOL, wintypes.LPCWSTR],
+    wintypes.HANDLE,
+)
+_SetEvent = _bind_win32(_kernel32, "SetEvent", [wintypes.HANDLE], wintypes.BOOL)
+_ResetEvent = _bind_win32(_kernel32, "ResetEvent", [wintypes.HANDLE], wintypes.BOOL)
+_CloseHandle = _bind_win32(_kernel32, "CloseHandle", [wintypes.HANDLE], wintypes.BOOL)
+
+
+class TrayState(NamedTuple):
+    """Immutable snapshot of the capture state; replaced wholesale under the state lock."""
+
+    top_left: tuple[int, int]
+    bottom_right: tuple[int, int]
+    top_left_revision: int = 0
+    bottom_right_revision: int = 0
+    captured_top_left_revision: int = 0
+    captured_bottom_right_revision: int = 0
+    gemini_request_in_flight: bool = False
+    answer_letter_icon: str | None = None
+    free_response_answer_text: str | None = None
+
+
 class TrayScreenshotApp:
     def __init__(
         self,
@@ -56,22 +171,36 @@ class TrayScreenshotApp:
         bottom_right: tuple[int, int] = (700, 500),
         icon_directory: str | Path = "icons",
     ) -> None:
-        self.top_left = top_left
-        self.bottom_right = bottom_right
+        self._state_lock = threading.Lock()
+        self._state = TrayState(top_left=top_left, bottom_right=bottom_right)
         self.icon_directory = Path(icon_directory)
         self.icon_paths: List[Path] = []
         self.icon_index = 0
+        self._icon_image_cache: OrderedDict[tuple[str, float], Image.Image] = OrderedDict()
         self.predefined_icons = PredefinedTrayIcons(size=64)
         self.predefined_icon_names = [
             "loading",
             "question",
             *[f"letter_{letter}" for letter in string.ascii_uppercase],
         ]
+        self._prebuilt_icons = {
+            icon_name: self.predefined_icons.generate(icon_name)
+            for icon_name in self.predefined_icons.available_names()
+        }
         self.predefined_icon_index = 0
         self.output_directory = Path("snips")
         self.logs_directory = Path("logs")
         self.gemini_error_log_file = self.logs_directory / "gemini_errors.txt"
         self.gemini_output_log_file = self.logs_directory / "gemini_output.txt"
+        self.output_directory.mkdir(parents=True, exist_ok=True)
+        self.logs_directory.mkdir(parents=True, exist_ok=True)
+        self._gemini_error_handle = self.gemini_error_log_file.open("a", encoding="utf-8", buffering=1)
+        self._gemini_output_handle = self.gemini_output_log_file.open("a", encoding="utf-8", buffering=1)
+        self._log_queue: queue.SimpleQueue[tuple[str, str, Path, str] | None] = queue.SimpleQueue()
+        self._log_close_lock = threading.Lock()
+        self._log_closed = False
+        self._log_writer_thread = threading.Thread(target=self._log_writer_loop, name="gemini-log-writer", daemon=True)
+        self._log_writer_thread.start()
         self.gemini_model_name = GEMINI_MODEL_NAME
         self.gemini_prompt_text = GEMINI_IMAGE_PROMPT
         self._status_icons = {
@@ -79,17 +208,12 @@ class TrayScreenshotApp:
             1: self._create_status_icon((230, 190, 70, 255)),
             2: self._create_status_icon((70, 190, 95, 255)),
         }
-        self._state_lock = threading.Lock()
-        self._top_left_revision = 0
-        self._bottom_right_revision = 0
-        self._captured_top_left_revision = 0
-        self._captured_bottom_right_revision = 0
-        self._gemini_request_in_flight = False
-        self._answer_letter_icon: str | None = None
-        self._free_response_answer_text: str | None = None
+        self._gemini_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-image-analysis")
         self._hotkey_thread: threading.Thread | None = None
-        self._hotkey_thread_id: int | None = None
-        self._stop_hotkey_event = threading.Event()
+        self._stop_event_handle: int | None = None
+        self._icon_lock = threading.Lock()
+        self._current_icon: Image.Image | None = None
+        self._cursor_point = POINT()
 
         self.icon = pystray.Icon(
             name="screen-snippet",
@@ -121,61 +245,71 @@ class TrayScreenshotApp:
         )
         return image
 
-    def _updated_corner_count(self) -> int:
+    @property
+    def top_left(self) -> tuple[int, int]:
+        return self._state.top_left
+
+    @property
+    def bottom_right(self) -> tuple[int, int]:
+        return self._state.bottom_right
+
+    def _update_state(self, **changes: Any) -> None:
         with self._state_lock:
-            top_left_updated = self._top_left_revision > self._captured_top_left_revision
-            bottom_right_updated = self._bottom_right_revision > self._captured_bottom_right_revision
-        return int(top_left_updated) + int(bottom_right_updated)
+            self._state = self._state._replace(**changes)
+
+    def _show_icon(self, new_icon: Image.Image) -> None:
+        # Icons are prebuilt or cached, so identity means the tray already shows this image.
+        with self._icon_lock:
+            if new_icon is self._current_icon:
+                return
+            self.icon.icon = new_icon
+            self._current_icon = new_icon
 
     def _sync_coordinate_status_icon(self) -> None:
-        with self._state_lock:
-            request_in_flight = self._gemini_request_in_flight
-            answer_letter_icon = self._answer_letter_icon
-            free_response_answer_text = self._free_response_answer_text
-        if request_in_flight:
+        # Read one snapshot so every field below comes from the same state.
+        state = self._state
+        if state.gemini_request_in_flight:
             self._set_loading_icon()
             return
-        if free_response_answer_text is not None:
-            self.icon.icon = self.predefined_icons.generate("pencil")
+        if state.free_response_answer_text is not None:
+            self._show_icon(self._prebuilt_icons["pencil"])
             return
-        if answer_letter_icon is not None:
-            self.icon.icon = self.predefined_icons.generate(f"letter_{answer_letter_icon}")
+        if state.answer_letter_icon is not None:
+            self._show_icon(self._prebuilt_icons[f"letter_{state.answer_letter_icon}"])
             return
-        updated_count = self._updated_corner_count()
-        self.icon.icon = self._status_icons[updated_count]
+        top_left_updated = state.top_left_revision > state.captured_top_left_revision
+        bottom_right_updated = state.bottom_right_revision > state.captured_bottom_right_revision
+        self._show_icon(self._status_icons[int(top_left_updated) + int(bottom_right_updated)])
 
-    def _is_capture_blocked(self) -> bool:
+    def _try_acquire_capture(self) -> bool:
+        # Check-and-set in one critical section so two triggers cannot both start a capture.
         with self._state_lock:
-            return self._gemini_request_in_flight
+            state = self._state
+            if state.gemini_request_in_flight:
+                return False
+            self._state = state._replace(gemini_request_in_flight=True)
+            return True
 
     def _set_capture_blocked(self, blocked: bool) -> None:
-        with self._state_lock:
-            self._gemini_request_in_flight = blocked
+        self._update_state(gemini_request_in_flight=blocked)
 
     def _clear_answer_letter_icon(self) -> None:
-        with self._state_lock:
-            self._answer_letter_icon = None
-            self._free_response_answer_text = None
+        self._update_state(answer_letter_icon=None, free_response_answer_text=None)
 
     def _set_answer_letter_icon(self, answer_letter: str) -> None:
         normalized = answer_letter.upper()
         if normalized not in string.ascii_uppercase:
             raise ValueError("Answer letter must be A-Z")
-        with self._state_lock:
-            self._answer_letter_icon = normalized
-            self._free_response_answer_text = None
+        self._update_state(answer_letter_icon=normalized, free_response_answer_text=None)
 
     def _set_free_response_answer(self, answer_text: str) -> None:
         cleaned = answer_text.strip()
         if not cleaned:
             raise ValueError("Free response answer cannot be empty")
-        with self._state_lock:
-            self._free_response_answer_text = cleaned
-            self._answer_letter_icon = None
+        self._update_state(free_response_answer_text=cleaned, answer_letter_icon=None)
 
     def _free_response_available(self, _item: Any) -> bool:
-        with self._state_lock:
-            return self._free_response_answer_text is not None
+        return self._state.free_response_answer_text is not None
 
     def _truncate_notification_text(self, text: str) -> str:
         cleaned = text.strip()
@@ -187,8 +321,7 @@ class TrayScreenshotApp:
         return no_spaces[: GEMINI_NOTIFICATION_MAX_LENGTH - 1].rstrip() + "…"
 
     def _notify_free_response(self) -> None:
-        with self._state_lock:
-            answer_text = self._free_response_answer_text
+        answer_text = self._state.free_response_answer_text
         if answer_text is None:
             return
         self.icon.notify(self._truncate_notification_text(answer_text), "Free Response")
@@ -196,58 +329,28 @@ class TrayScreenshotApp:
     def _on_open_free_response(self, _icon: Any, _item: Any) -> None:
         self._notify_free_response()
 
-    def _extract_gemini_json(self, response_text: str) -> dict[str, Any] | None:
+    def _extract_answer_letter(self, response_text: str, parsed_json: dict[str, Any] | None) -> str | None:
         compact = response_text.strip()
 
-        if compact.startswith("```"):
-            code_match = re.search(r"```(?:json)?\s*(\{.*\})\s*```", compact, re.IGNORECASE | re.DOTALL)
-            if code_match:
-                compact = code_match.group(1).strip()
-
-        try:
-            candidate = json.loads(compact)
-            if isinstance(candidate, dict):
-                return candidate
-        except json.JSONDecodeError:
-            object_match = re.search(r"\{.*\}", compact, re.DOTALL)
-            if object_match:
-                try:
-                    candidate = json.loads(object_match.group(0))
-                    if isinstance(candidate, dict):
-                        return candidate
-                except json.JSONDecodeError:
-                    return None
-
-        return None
-
-    def _extract_answer_letter(self, response_text: str) -> str | None:
-        compact = response_text.strip()
-
-        parsed_json = self._extract_gemini_json(compact)
-
         if parsed_json is not None:
             answer_value = parsed_json.get("answer")
             if isinstance(answer_value, str):
                 answer_letter = answer_value.strip().upper()
-                if re.fullmatch(r"[A-Z]", answer_letter):
+                if len(answer_letter) == 1 and "A" <= answer_letter <= "Z":
                     return answer_letter
 
         normalized = compact.upper()
-        answer_pattern = re.search(
-            r"\b(?:ANSWER|CORRECT\s+ANSWER|OPTION|CHOICE)\b\s*[:\-]?\s*\(?\s*([A-Z])\s*\)?",
-            normalized,
-        )
-        if answer_pattern:
-            return answer_pattern.group(1)
+        answer_letter = _find_answer_phrase_letter(normalized)
+        if answer_letter is not None:
+            return answer_letter
 
-        standalone_letter = re.search(r"\b([A-Z])\b", normalized)
+        standalone_letter = _ANSWER_LETTER_RE.search(normalized)
         if standalone_letter:
             return standalone_letter.group(1)
 
         return None
 
-    def _extract_free_response_answer(self, response_text: str) -> str | None:
-        parsed_json = self._extract_gemini_json(response_text)
+    def _extract_free_response_answer(self, parsed_json: dict[str, Any] | None) -> str | None:
         if parsed_json is None:
             return None
 
@@ -275,90 +378,125 @@ class TrayScreenshotApp:
         return None
 
     def _read_mouse_position(self) -> tuple[int, int]:
-        point = POINT()
-        if not ctypes.windll.user32.GetCursorPos(ctypes.byref(point)):
+        # Only the hotkey thread reads the cursor, so one buffer can be reused.
+        point = self._cursor_point
+        if not _GetCursorPos(ctypes.byref(point)):
             raise RuntimeError("Unable to read mouse cursor position.")
         return int(point.x), int(point.y)
 
     def _set_top_left_from_mouse(self) -> bool:
         position = self._read_mouse_position()
+        if position == self._state.top_left:
+            return False
         with self._state_lock:
-            if position == self.top_left:
+            state = self._state
+            if position == state.top_left:
                 return False
-            self.top_left = position
-            self._top_left_revision += 1
+            self._state = state._replace(top_left=position, top_left_revision=state.top_left_revision + 1)
             return True
 
     def _set_bottom_right_from_mouse(self) -> bool:
         position = self._read_mouse_position()
+        if position == self._state.bottom_right:
+            return False
         with self._state_lock:
-            if position == self.bottom_right:
+            state = self._state
+            if position == state.bottom_right:
                 return False
-            self.bottom_right = position
-            self._bottom_right_revision += 1
+            self._state = state._replace(
+                bottom_right=position,
+                bottom_right_revision=state.bottom_right_revision + 1,
+            )
             return True
 
     def _set_loading_icon(self) -> None:
-        self.icon.icon = self.predefined_icons.generate("loading")
+        self._show_icon(self._prebuilt_icons["loading"])
 
     def _notify_gemini_response(self, response_text: str) -> None:
         _ = response_text
 
     def _log_gemini_error(self, image_path: Path, error_message: str) -> Path:
-        self.logs_directory.mkdir(parents=True, exist_ok=True)
-        timestamp = datetime.now().isoformat(timespec="seconds")
-        with self.gemini_error_log_file.open("a", encoding="utf-8") as handle:
-            handle.write(f"[{timestamp}] image={image_path}\n")
-            handle.write(f"error={error_message}\n\n")
-        with self.gemini_output_log_file.open("a", encoding="utf-8") as handle:
-            handle.write(f"[{timestamp}] image={image_path}\n")
-            handle.write("error=\n")
-            handle.write(f"{error_message.strip()}\n\n")
+        self._enqueue_log_entry(("error", time.strftime("%Y-%m-%dT%H:%M:%S"), image_path, error_message))
         return self.gemini_error_log_file
 
     def _log_gemini_output(self, image_path: Path, response_text: str) -> Path:
-        self.logs_directory.mkdir(parents=True, exist_ok=True)
-        timestamp = datetime.now().isoformat(timespec="seconds")
-        with self.gemini_output_log_file.open("a", encoding="utf-8") as handle:
-            handle.write(f"[{timestamp}] image={image_path}\n")
-            handle.write("response=\n")
-            handle.write(f"{response_text.strip()}\n\n")
+        self._enqueue_log_entry(("output", time.strftime("%Y-%m-%dT%H:%M:%S"), image_path, response_text))
         return self.gemini_output_log_file
 
-    def _wait_for_image_ready(self, image_path: Path) -> None:
-        deadline = time.monotonic() + IMAGE_READY_TIMEOUT_SECONDS
-        last_error: Exception | None = None
-
-        while time.monotonic() < deadline:
+    def _enqueue_log_entry(self, entry: tuple[str, str, Path, str]) -> None:
+        with self._log_close_lock:
+            if not self._log_closed:
+                self._log_queue.put(entry)
+                return
+            # Quit already drained the writer (an analysis can finish during shutdown), so append directly.
             try:
-                if image_path.exists() and image_path.is_file() and image_path.stat().st_size > 0:
-                    with Image.open(image_path) as image:
-                        image.load()
-                        width, height = image.size
-                        if width > 0 and height > 0:
-                            return
-            except (OSError, ValueError) as exc:
-                last_error = exc
+                with self.gemini_error_log_file.open("a", encoding="utf-8") as error_handle:
+                    with self.gemini_output_log_file.open("a", encoding="utf-8") as output_handle:
+                        self._write_log_entry(entry, error_handle, output_handle)
+            except (OSError, ValueError):
+                logger.exception("Failed to write Gemini log entry for %s", entry[2])
+
+    def _write_log_entry(self, entry: tuple[str, str, Path, str], error_handle: Any, output_handle: Any) -> None:
+        kind, timestamp, image_path, text = entry
+        if kind == "error":
+            error_handle.write(f"[{timestamp}] image={image_path}\nerror={text}\n\n")
+            error_handle.flush()
+            output_handle.write(f"[{timestamp}] image={image_path}\nerror=\n{text.strip()}\n\n")
+        else:
+            output_handle.write(f"[{timestamp}] image={image_path}\nresponse=\n{text.strip()}\n\n")
+        output_handle.flush()
+
+    def _log_writer_loop(self) -> None:
+        # Sole writer of both log handles, so the Gemini worker only pays for a queue put.
+        while True:
+            entry = self._log_queue.get()
+            if entry is None:
+                return
+            try:
+                self._write_log_entry(entry, self._gemini_error_handle, self._gemini_output_handle)
+            except (OSError, ValueError):
+                # Keep the thread alive: one failed write (disk full, locked file) must not stall later entries.
+                logger.exception("Failed to write Gemini log entry for %s", entry[2])
+
+    def _close_log_handles(self) -> None:
+        # Entries logged after this point bypass the queue; see _enqueue_log_entry.
+        with self._log_close_lock:
+            if self._log_closed:
+                return
+            self._log_closed = True
+            self._log_queue.put(None)
+            self._log_writer_thread.join(timeout=1.0)
+            if self._log_writer_thread.is_alive():
+                return
+            self._gemini_error_handle.close()
+            self._gemini_output_handle.close()
 
-            time.sleep(IMAGE_READY_POLL_SECONDS)
+    def _verify_image_file(self, image_path: Path) -> None:
+        # capture_and_save writes synchronously, so one header check is enough; no polling or decode.
+        try:
+            with image_path.open("rb") as handle:
+                header = handle.read(12)
+        except OSError as exc:
+            raise RuntimeError(f"Screenshot file not ready: {exc}") from exc
 
-        if last_error is not None:
-            raise RuntimeError(f"Screenshot file not ready: {last_error}") from last_error
-        raise RuntimeError("Screenshot file not ready before Gemini upload timeout.")
+        is_png = header.startswith(PNG_SIGNATURE)
+        is_webp = header[:4] == b"RIFF" and header[8:12] == b"WEBP"
+        if not is_png and not is_webp:
+            raise RuntimeError(f"Screenshot file is not a PNG or WebP image: {image_path}")
 
     def _analyze_with_gemini(self, image_path: Path) -> None:
         try:
-            response_text = prompt_with_uploaded_image(
+            response_text, parsed_json = prompt_with_uploaded_image_parsed(
                 prompt=self.gemini_prompt_text,
                 image_path=image_path,
                 model_name=self.gemini_model_name,
             )
             self._log_gemini_output(image_path=image_path, response_text=response_text)
-            free_response_answer = self._extract_free_response_answer(response_text)
+            free_response_answer = self._extract_free_response_answer(parsed_json)
             if free_response_answer is not None:
                 self._set_free_response_answer(free_response_answer)
             else:
-                answer_letter = self._extract_answer_letter(response_text)
+                answer_letter = self._extract_answer_letter(response_text, parsed_json)
                 if answer_letter is not None:
                     self._set_answer_letter_icon(answer_letter)
             self._notify_gemini_response(response_text)
@@ -371,24 +509,17 @@ class TrayScreenshotApp:
             self._sync_coordinate_status_icon()
 
     def _start_gemini_analysis(self, image_path: Path) -> None:
-        threading.Thread(
-            target=self._analyze_with_gemini,
-            args=(image_path,),
-            name="gemini-image-analysis",
-            daemon=True,
-        ).start()
+        self._gemini_executor.submit(self._analyze_with_gemini, image_path)
 
     def _capture_and_process(self, top_left: tuple[int, int], bottom_right: tuple[int, int]) -> Path:
-        if self._is_capture_blocked():
-            raise RuntimeError("Gemini is still processing the previous screenshot.")
-
-        self._set_capture_blocked(True)
+        # Callers acquire the in-flight flag via _try_acquire_capture; it is released here on failure
+        # or by _analyze_with_gemini once the response is handled.
         self._set_loading_icon()
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_file = self.output_directory / f"snippet_{timestamp}.png"
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        output_file = self.output_directory / f"snippet_{timestamp}.webp"
         try:
             saved_path = capture_and_save(top_left, bottom_right, output_file)
-            self._wait_for_image_ready(saved_path)
+            self._verify_image_file(saved_path)
             self._start_gemini_analysis(saved_path)
             return saved_path
         except Exception as exc:
@@ -399,27 +530,20 @@ class TrayScreenshotApp:
             raise
 
     def _try_capture_after_corner_updates(self) -> None:
-        if self._is_capture_blocked():
+        state = self._state
+        both_updated = (
+            state.top_left_revision > state.captured_top_left_revision
+            and state.bottom_right_revision > state.captured_bottom_right_revision
+        )
+        if not both_updated or not self._try_acquire_capture():
             return
 
-        with self._state_lock:
-            both_updated = (
-                self._top_left_revision > self._captured_top_left_revision
-                and self._bottom_right_revision > self._captured_bottom_right_revision
-            )
-            if not both_updated:
-                return
-            top_left = self.top_left
-            bottom_right = self.bottom_right
-            top_left_revision = self._top_left_revision
-            bottom_right_revision = self._bottom_right_revision
-
         try:
-            self._set_loading_icon()
-            self._capture_and_process(top_left, bottom_right)
-            with self._state_lock:
-                self._captured_top_left_revision = top_left_revision
-                self._captured_bottom_right_revision = bottom_right_revision
+            self._capture_and_process(state.top_left, state.bottom_right)
+            self._update_state(
+                captured_top_left_revision=state.top_left_revision,
+                captured_bottom_right_revision=state.bottom_right_revision,
+            )
         except Exception as exc:  # pragma: no cover
             detailed_error = f"{exc}\n{traceback.format_exc()}"
             image_stub = self.output_directory / "capture_failed_hotkey.png"
@@ -439,67 +563,92 @@ class TrayScreenshotApp:
             self._try_capture_after_corner_updates()
 
     def _hotkey_loop(self) -> None:
-        user32 = ctypes.windll.user32
-        kernel32 = ctypes.windll.kernel32
-
-        self._hotkey_thread_id = int(kernel32.GetCurrentThreadId())
-        register_top_left = bool(user32.RegisterHotKey(None, HOTKEY_ID_TOP_LEFT, MOD_NOREPEAT, VK_LEFT))
-        register_bottom_right = bool(
-            user32.RegisterHotKey(None, HOTKEY_ID_BOTTOM_RIGHT, MOD_NOREPEAT, VK_RIGHT)
-        )
+        register_top_left = bool(_RegisterHotKey(None, HOTKEY_ID_TOP_LEFT, MOD_NOREPEAT, VK_LEFT))
+        register_bottom_right = bool(_RegisterHotKey(None, HOTKEY_ID_BOTTOM_RIGHT, MOD_NOREPEAT, VK_RIGHT))
 
         if not register_top_left or not register_bottom_right:
             if register_top_left:
-                user32.UnregisterHotKey(None, HOTKEY_ID_TOP_LEFT)
+                _UnregisterHotKey(None, HOTKEY_ID_TOP_LEFT)
             if register_bottom_right:
-                user32.UnregisterHotKey(None, HOTKEY_ID_BOTTOM_RIGHT)
-            self._hotkey_thread_id = None
+                _UnregisterHotKey(None, HOTKEY_ID_BOTTOM_RIGHT)
             return
 
+        # Block until either the stop event is signalled or input arrives, then drain the queue.
+        wait_handles = (wintypes.HANDLE * 1)(self._stop_event_handle)
         msg = wintypes.MSG()
-        while not self._stop_hotkey_event.is_set() and user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+        while True:
+            wait_result = _MsgWaitForMultipleObjectsEx(1, wait_handles, INFINITE, QS_ALLINPUT, MWMO_INPUTAVAILABLE)
+            if wait_result != WAIT_OBJECT_0 + 1:
+                break
+            if not self._drain_hotkey_messages(msg):
+                break
+
+        _UnregisterHotKey(None, HOTKEY_ID_TOP_LEFT)
+        _UnregisterHotKey(None, HOTKEY_ID_BOTTOM_RIGHT)
+
+    def _drain_hotkey_messages(self, msg: wintypes.MSG) -> bool:
+        while _PeekMessageW(ctypes.byref(msg), None, 0, 0, PM_REMOVE):
+            if msg.message == WM_QUIT:
+                return False
             if msg.message == WM_HOTKEY:
                 self._on_hotkey(int(msg.wParam))
-
-        user32.UnregisterHotKey(None, HOTKEY_ID_TOP_LEFT)
-        user32.UnregisterHotKey(None, HOTKEY_ID_BOTTOM_RIGHT)
-        self._hotkey_thread_id = None
+        return True
 
     def _start_hotkey_listener(self) -> None:
         if self._hotkey_thread is not None:
             return
-        self._stop_hotkey_event.clear()
+        if self._stop_event_handle is None:
+            self._stop_event_handle = _CreateEventW(None, True, False, None)
+            if not self._stop_event_handle:
+                self._stop_event_handle = None
+                raise RuntimeError("Unable to create hotkey stop event.")
+        else:
+            _ResetEvent(self._stop_event_handle)
         self._hotkey_thread = threading.Thread(target=self._hotkey_loop, name="tray-hotkey-listener", daemon=True)
         self._hotkey_thread.start()
 
     def _stop_hotkey_listener(self) -> None:
         if self._hotkey_thread is None:
             return
-        self._stop_hotkey_event.set()
-        if self._hotkey_thread_id is not None:
-            ctypes.windll.user32.PostThreadMessageW(self._hotkey_thread_id, WM_QUIT, 0, 0)
+        _SetEvent(self._stop_event_handle)
         self._hotkey_thread.join(timeout=1.0)
         self._hotkey_thread = None
 
+    def _close_stop_event_handle(self) -> None:
+        if self._stop_event_handle is not None and self._hotkey_thread is None:
+            _CloseHandle(self._stop_event_handle)
+            self._stop_event_handle = None
+
     def _load_icon_image(self, icon_path: Path) -> Image.Image:
+        cache_key = (str(icon_path), icon_path.stat().st_mtime)
+        cached = self._icon_image_cache.get(cache_key)
+        if cached is not None:
+            self._icon_image_cache.move_to_end(cache_key)
+            return cached
+
         with Image.open(icon_path) as image:
-            return image.copy()
+            loaded = image.copy()
+        self._icon_image_cache[cache_key] = loaded
+        if len(self._icon_image_cache) > ICON_IMAGE_CACHE_SIZE:
+            self._icon_image_cache.popitem(last=False)
+        return loaded
 
     def _create_fallback_icon(self) -> Image.Image:
-        return self.predefined_icons.generate("loading")
+        return self._prebuilt_icons["loading"]
 
     def _list_icon_files(self, img_directory: str | Path) -> list[Path]:
-        directory = Path(img_directory)
-        if not directory.exists() or not directory.is_dir():
+        # scandir entries carry the file type from the directory listing, so no per-file stat is needed.
+        try:
+            with os.scandir(img_directory) as entries:
+                icon_files = [
+                    Path(entry.path)
+                    for entry in entries
+                    if os.path.splitext(entry.name)[1].lower() in SUPPORTED_ICON_EXTENSIONS and entry.is_file()
+                ]
+        except (FileNotFoundError, NotADirectoryError):
             return []
-
-        return sorted(
-            [
-                path
-                for path in directory.iterdir()
-                if path.is_file() and path.suffix.lower() in SUPPORTED_ICON_EXTENSIONS
-            ]
-        )
+        icon_files.sort()
+        return icon_files
 
     def change_icons_from_directory(self, img_directory: str | Path) -> int:
         """Load icons from a directory and apply the first icon.
@@ -508,14 +657,15 @@ class TrayScreenshotApp:
             Number of icon files loaded.
         """
         self.icon_directory = Path(img_directory)
+        self._icon_image_cache.clear()
         self.icon_paths = self._list_icon_files(self.icon_directory)
         self.icon_index = 0
 
         if self.icon_paths:
-            self.icon.icon = self._load_icon_image(self.icon_paths[0])
+            self._show_icon(self._load_icon_image(self.icon_paths[0]))
         else:
             self.predefined_icon_index = 0
-            self.icon.icon = self.predefined_icons.generate(self.predefined_icon_names[0])
+            self._show_icon(self._prebuilt_icons[self.predefined_icon_names[0]])
 
         return len(self.icon_paths)
 
@@ -525,18 +675,19 @@ class TrayScreenshotApp:
             return
 
         self.icon_index = (self.icon_index + 1) % len(self.icon_paths)
-        self.icon.icon = self._load_icon_image(self.icon_paths[self.icon_index])
+        self._show_icon(self._load_icon_image(self.icon_paths[self.icon_index]))
 
     def _set_next_predefined_icon(self) -> None:
         self.predefined_icon_index = (self.predefined_icon_index + 1) % len(self.predefined_icon_names)
         name = self.predefined_icon_names[self.predefined_icon_index]
-        self.icon.icon = self.predefined_icons.generate(name)
+        self._show_icon(self._prebuilt_icons[name])
 
     def _capture_now(self) -> Path:
-        return self._capture_and_process(self.top_left, self.bottom_right)
+        state = self._state
+        return self._capture_and_process(state.top_left, state.bottom_right)
 
     def _on_capture(self, _icon: Any, _item: Any) -> None:
-        if self._is_capture_blocked():
+        if not self._try_acquire_capture():
             return
 
         try:
@@ -561,9 +712,13 @@ class TrayScreenshotApp:
 
     def _on_quit(self, _icon: Any, _item: Any) -> None:
         self._stop_hotkey_listener()
+        self._close_stop_event_handle()
+        self._gemini_executor.shutdown(wait=False, cancel_futures=True)
+        self._close_log_handles()
         self.icon.stop()
 
     def run(self) -> None:
+        warm_up_gemini(model_name=self.gemini_model_name)
         self._start_hotkey_listener()
         self.icon.run()
 
@@ -11,13 +11,26 @@ class PredefinedTrayIcons:
 
     def __init__(self, size: int = 64) -> None:
         self.size = size
+        self._cache: dict[str, Image.Image] = {}
+        self._font = ImageFont.load_default(size=34)
 
     def available_names(self) -> list[str]:
         return ["loading", "question", "pencil", *[f"letter_{letter}" for letter in string.ascii_uppercase]]
 
     def generate(self, name: str) -> Image.Image:
+        """Return the named icon, building it on first use.
+
+        Icons are deterministic for a given name and size, so the same image
+        object is returned on every later call; callers must not mutate it.
+        """
         normalized = name.strip().lower()
+        image = self._cache.get(normalized)
+        if image is None:
+            image = self._build(name, normalized)
+            self._cache[normalized] = image
+        return image
 
+    def _build(self, name: str, normalized: str) -> Image.Image:
         if normalized == "loading":
             return self.loading_wheel_icon()
         if normalized == "question":
@@ -70,9 +83,10 @@ class PredefinedTrayIcons:
         return image
 
     def question_mark_icon(self) -> Image.Image:
-        image = Image.new("RGBA", (self.size, self.size), (30, 70, 150, 255))
+        # Fully opaque, so skip the alpha channel pystray would otherwise convert per pixel.
+        image = Image.new("RGB", (self.size, self.size), (30, 70, 150))
         draw = ImageDraw.Draw(image)
-        font = ImageFont.load_default(size=34)
+        font = self._font
 
         bbox = draw.textbbox((0, 0), "?", font=font)
         text_width = bbox[2] - bbox[0]
@@ -80,16 +94,16 @@ class PredefinedTrayIcons:
         x = (self.size - text_width) // 2
         y = (self.size - text_height) // 2 - 2
 
-        draw.text((x, y), "?", font=font, fill=(255, 255, 255, 255))
+        draw.text((x, y), "?", font=font, fill=(255, 255, 255))
         return image
 
     def letter_icon(self, letter: str) -> Image.Image:
         if letter.upper() not in string.ascii_uppercase:
             raise ValueError("Letter must be A-Z")
 
-        image = Image.new("RGBA", (self.size, self.size), (20, 20, 20, 255))
+        image = Image.new("RGB", (self.size, self.size), (20, 20, 20))
         draw = ImageDraw.Draw(image)
-        font = ImageFont.load_default(size=34)
+        font = self._font
         content = letter.upper()
 
         bbox = draw.textbbox((0, 0), content, font=font)
@@ -98,8 +112,8 @@ class PredefinedTrayIcons:
         x = (self.size - text_width) // 2
         y = (self.size - text_height) // 2 - 2
 
-        draw.rounded_rectangle((4, 4, self.size - 4, self.size - 4), radius=10, fill=(45, 45, 45, 255))
-        draw.text((x, y), content, font=font, fill=(120, 230, 120, 255))
+        draw.rounded_rectangle((4, 4, self.size - 4, self.size - 4), radius=10, fill=(45, 45, 45))
+        draw.text((x, y), content, font=font, fill=(120, 230, 120))
         return image
 
     def pencil_icon(self) -> Image.Image: